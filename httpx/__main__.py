@@ -0,0 +1,4 @@
+from ._main import _fast_main
+
+if __name__ == "__main__":
+    _fast_main()
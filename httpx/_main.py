@@ -1,35 +1,95 @@
+import errno
 import functools
+import importlib.util
 import json
 import sys
+import time
 import typing
 
 import click
 import httpcore
-import pygments.lexers
-import pygments.util
-import rich.console
-import rich.markup
-import rich.progress
-import rich.syntax
-import rich.table
 
 from ._client import Client
 from ._exceptions import RequestError
 from ._models import Response
 from ._status_codes import codes
 
+# `rich` and `pygments` are imported lazily, since they are comparatively
+# expensive to import, and `httpx._main` is imported by `import httpx`.
+# We still need to fail at import time if they're missing, so that `httpx.main`
+# falls back to prompting the user to install `httpx[cli]`.
+if importlib.util.find_spec("rich") is None:
+    raise ImportError("The 'rich' package is required by the httpx CLI.")
+if importlib.util.find_spec("pygments") is None:
+    raise ImportError("The 'pygments' package is required by the httpx CLI.")
 
-def print_help() -> None:
-    console = rich.console.Console()
+if typing.TYPE_CHECKING:  # pragma: no cover
+    import rich.console
+    import rich.table
+    import rich.text
+
+_CONSOLE: typing.Optional["rich.console.Console"] = None
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+_PROGRESS_UPDATE_BYTES = 16 * _DOWNLOAD_CHUNK_SIZE
+_PROGRESS_UPDATE_INTERVAL = 0.05  # seconds
+
+
+def _get_console() -> "rich.console.Console":
+    global _CONSOLE
+    if _CONSOLE is None:
+        import rich.console
+
+        _CONSOLE = rich.console.Console()
+    return _CONSOLE
+
+
+def _render_http_headers(http_text: str) -> "rich.text.Text":
+    """
+    Highlight a request or response header block, using the same styles as
+    the Pygments HTTP lexer with the "ansi_dark" theme would.
+
+    The structure of a header block is simple enough that we don't need to
+    pay for running a regex based lexer over it.
+    """
+    import rich.text
+
+    first_line, *header_lines = http_text.split("\n")
+    first, second, third = first_line.split(" ", 2)
+    text = rich.text.Text()
+    if first.startswith("HTTP/"):
+        # Status line, eg. "HTTP/1.1 200 OK"
+        _append_http_version(text, first)
+        text.append(" ")
+        text.append(second, style="bright_blue")
+        text.append(" ")
+        text.append(third, style="bright_cyan")
+    else:
+        # Request line, eg. "GET / HTTP/1.1"
+        text.append(first, style="bright_green")
+        text.append(" ")
+        text.append(second, style="underline bright_cyan")
+        text.append(" ")
+        _append_http_version(text, third)
+
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        text.append("\n")
+        text.append(name, style="bright_cyan")
+        text.append(":")
+        text.append(value)
+    return text
 
-    console.print("[bold]HTTPX :butterfly:", justify="center")
-    console.print()
-    console.print("A next generation HTTP client.", justify="center")
-    console.print()
-    console.print(
-        "Usage: [bold]httpx[/bold] [cyan]<URL> [OPTIONS][/cyan] ", justify="left"
-    )
-    console.print()
+
+def _append_http_version(text: "rich.text.Text", version: str) -> None:
+    protocol, slash, number = version.partition("/")
+    text.append(protocol, style="bright_blue")
+    text.append(slash)
+    text.append(number, style="bright_blue")
+
+
+@functools.lru_cache(maxsize=None)
+def _build_help_table() -> "rich.table.Table":
+    import rich.table
 
     table = rich.table.Table.grid(padding=1, pad_edge=True)
     table.add_column("Parameter", no_wrap=True, justify="left", style="bold")
@@ -93,33 +153,50 @@ def print_help() -> None:
 
     table.add_row("-v, --verbose", "Verbose output. Show request as well as response.")
     table.add_row("--help", "Show this message and exit.")
-    console.print(table)
+    return table
+
+
+def print_help() -> None:
+    console = _get_console()
+
+    console.print("[bold]HTTPX :butterfly:", justify="center")
+    console.print()
+    console.print("A next generation HTTP client.", justify="center")
+    console.print()
+    console.print(
+        "Usage: [bold]httpx[/bold] [cyan]<URL> [OPTIONS][/cyan] ", justify="left"
+    )
+    console.print()
+    console.print(_build_help_table())
+
+
+@functools.lru_cache(maxsize=128)
+def _lexer_name_for_mimetype(mime_type: str) -> str:
+    import pygments.lexers
+    import pygments.util
+
+    try:
+        return typing.cast(str, pygments.lexers.get_lexer_for_mimetype(mime_type).name)
+    except pygments.util.ClassNotFound:  # pragma: no cover
+        return ""
 
 
 def get_lexer_for_response(response: Response) -> str:
     content_type = response.headers.get("Content-Type")
     if content_type is not None:
         mime_type, _, _ = content_type.partition(";")
-        try:
-            return typing.cast(
-                str, pygments.lexers.get_lexer_for_mimetype(mime_type.strip()).name
-            )
-        except pygments.util.ClassNotFound:  # pragma: no cover
-            pass
+        return _lexer_name_for_mimetype(mime_type.strip())
     return ""  # pragma: no cover
 
 
 def format_request_headers(request: httpcore.Request, http2: bool = False) -> str:
-    version = "HTTP/2" if http2 else "HTTP/1.1"
-    headers = [
-        (name.lower() if http2 else name, value) for name, value in request.headers
-    ]
-    method = request.method.decode("ascii")
-    target = request.url.target.decode("ascii")
-    lines = [f"{method} {target} {version}"] + [
-        f"{name.decode('ascii')}: {value.decode('ascii')}" for name, value in headers
-    ]
-    return "\n".join(lines)
+    version = b"HTTP/2" if http2 else b"HTTP/1.1"
+    lines = [b" ".join([request.method, request.url.target, version])]
+    lines.extend(
+        (name.lower() if http2 else name) + b": " + value
+        for name, value in request.headers
+    )
+    return b"\n".join(lines).decode("ascii")
 
 
 def format_response_headers(
@@ -128,25 +205,28 @@ def format_response_headers(
     reason_phrase: typing.Optional[bytes],
     headers: typing.List[typing.Tuple[bytes, bytes]],
 ) -> str:
-    version = http_version.decode("ascii")
     reason = (
-        codes.get_reason_phrase(status)
+        codes.get_reason_phrase(status).encode("ascii")
         if reason_phrase is None
-        else reason_phrase.decode("ascii")
+        else reason_phrase
     )
-    lines = [f"{version} {status} {reason}"] + [
-        f"{name.decode('ascii')}: {value.decode('ascii')}" for name, value in headers
-    ]
-    return "\n".join(lines)
+    lines = [b" ".join([http_version, str(status).encode("ascii"), reason])]
+    lines.extend(name + b": " + value for name, value in headers)
+    return b"\n".join(lines).decode("ascii")
+
+
+def print_headers_with_delimiter(http_text: str) -> None:
+    console = _get_console()
+    if not console.is_terminal:
+        # No point in syntax highlighting output that is being redirected.
+        sys.stdout.write(f"{http_text}\n\n")
+        return
+    console.print(_render_http_headers(http_text), end="\n\n")
 
 
 def print_request_headers(request: httpcore.Request, http2: bool = False) -> None:
-    console = rich.console.Console()
     http_text = format_request_headers(request, http2=http2)
-    syntax = rich.syntax.Syntax(http_text, "http", theme="ansi_dark", word_wrap=True)
-    console.print(syntax)
-    syntax = rich.syntax.Syntax("", "http", theme="ansi_dark", word_wrap=True)
-    console.print(syntax)
+    print_headers_with_delimiter(http_text)
 
 
 def print_response_headers(
@@ -155,27 +235,54 @@ def print_response_headers(
     reason_phrase: typing.Optional[bytes],
     headers: typing.List[typing.Tuple[bytes, bytes]],
 ) -> None:
-    console = rich.console.Console()
     http_text = format_response_headers(http_version, status, reason_phrase, headers)
-    syntax = rich.syntax.Syntax(http_text, "http", theme="ansi_dark", word_wrap=True)
-    console.print(syntax)
-    syntax = rich.syntax.Syntax("", "http", theme="ansi_dark", word_wrap=True)
-    console.print(syntax)
+    print_headers_with_delimiter(http_text)
+
+
+def is_formatted_json(text: str) -> bool:
+    """
+    Returns `True` if the text looks like an already pretty-printed JSON
+    document, in which case we can highlight it as-is.
+    """
+    stripped = text.lstrip()
+    return stripped[:1] in ("{", "[") and "\n" in stripped.rstrip()
+
+
+def write_raw(response: Response) -> None:
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:
+        # Not every text stream has an underlying binary buffer.
+        sys.stdout.write(response.text)
+        return
+    sys.stdout.flush()
+    buffer.write(response.content)
+    buffer.flush()
 
 
 def print_response(response: Response) -> None:
-    console = rich.console.Console()
+    import rich.syntax
+
+    console = _get_console()
     lexer_name = get_lexer_for_response(response)
     if lexer_name:
-        if lexer_name.lower() == "json":
+        is_json = lexer_name.lower() == "json"
+        if not is_json and not console.is_terminal:
+            # Output is being redirected, and there's no reformatting to do,
+            # so write the raw body without decoding and re-encoding it.
+            write_raw(response)
+            return
+
+        text = response.text
+        if is_json and not is_formatted_json(text):
             try:
-                data = response.json()
-                text = json.dumps(data, indent=4)
+                text = json.dumps(json.loads(text), indent=4)
             except ValueError:  # pragma: no cover
-                text = response.text
-        else:
-            text = response.text
+                pass
 
+        if not console.is_terminal:
+            # No point in syntax highlighting output that is being redirected.
+            sys.stdout.write(text if text.endswith("\n") else f"{text}\n")
+            return
         syntax = rich.syntax.Syntax(text, lexer_name, theme="ansi_dark", word_wrap=True)
         console.print(syntax)
     else:
@@ -208,7 +315,11 @@ def format_certificate(cert: _PeerCertRetDictType) -> str:  # pragma: no cover
 def trace(
     name: str, info: typing.Mapping[str, typing.Any], verbose: bool = False
 ) -> None:
-    console = rich.console.Console()
+    if not verbose and not name.endswith(".receive_response_headers.complete"):
+        # Response headers are the only trace events shown without --verbose.
+        return
+
+    console = _get_console()
     if name == "connection.connect_tcp.started" and verbose:
         host = info["host"]
         console.print(f"* Connecting to {host!r}")
@@ -245,9 +356,15 @@ def trace(
 
 
 def download_response(response: Response, download: typing.BinaryIO) -> None:
-    console = rich.console.Console()
+    import rich.markup
+    import rich.progress
+
+    console = _get_console()
     console.print()
-    content_length = response.headers.get("Content-Length")
+    try:
+        total: typing.Optional[int] = int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        total = None
     with rich.progress.Progress(
         "[progress.description]{task.description}",
         "[progress.percentage]{task.percentage:>3.0f}%",
@@ -257,13 +374,22 @@ def download_response(response: Response, download: typing.BinaryIO) -> None:
     ) as progress:
         description = f"Downloading [bold]{rich.markup.escape(download.name)}"
         download_task = progress.add_task(
-            description,
-            total=int(content_length or 0),
-            start=content_length is not None,
+            description, total=total or 0, start=total is not None
         )
-        for chunk in response.iter_bytes():
+        last_update_bytes = 0
+        last_update_time = time.monotonic()
+        for chunk in response.iter_bytes(chunk_size=_DOWNLOAD_CHUNK_SIZE):
             download.write(chunk)
-            progress.update(download_task, completed=response.num_bytes_downloaded)
+            now = time.monotonic()
+            if (
+                response.num_bytes_downloaded - last_update_bytes
+                >= _PROGRESS_UPDATE_BYTES
+                or now - last_update_time >= _PROGRESS_UPDATE_INTERVAL
+            ):
+                progress.update(download_task, completed=response.num_bytes_downloaded)
+                last_update_bytes = response.num_bytes_downloaded
+                last_update_time = now
+        progress.update(download_task, completed=response.num_bytes_downloaded)
 
 
 def validate_json(
@@ -414,6 +540,7 @@ def handle_help(
     "verify",
     is_flag=True,
     default=True,
+    flag_value=False,
     help="Disable SSL verification.",
 )
 @click.option(
@@ -448,7 +575,7 @@ def handle_help(
 def main(
     url: str,
     method: str,
-    params: typing.List[typing.Tuple[str, str]],
+    params: typing.Tuple[typing.Tuple[str, str], ...],
     content: str,
     data: typing.List[typing.Tuple[str, str]],
     files: typing.List[typing.Tuple[str, click.File]],
@@ -481,7 +608,7 @@ def main(
             with client.stream(
                 method,
                 url,
-                params=list(params),
+                params=params,
                 content=content,
                 data=dict(data),
                 files=files,  # type: ignore
@@ -498,10 +625,158 @@ def main(
                     response.read()
                     if response.content:
                         print_response(response)
+                status_code = response.status_code
+                exit_code = 0 if 200 <= status_code < 300 else 1
 
     except RequestError as exc:
-        console = rich.console.Console()
+        console = _get_console()
         console.print(f"[red]{type(exc).__name__}[/red]: {exc}")
+        exit_code = 1
+
+    sys.exit(exit_code)
+
+
+# Each option on `main` is registered under all of its aliases, so that
+# `_fast_main` can resolve any flag with a single lookup, while still sharing
+# the type conversions and validation callbacks of the click command.
+_OPTIONS: typing.Dict[str, click.Option] = {
+    flag: param
+    for param in main.params
+    if isinstance(param, click.Option)
+    for flag in param.opts + param.secondary_opts
+}
+
+
+def _parse_args(
+    args: typing.Sequence[str], ctx: click.Context
+) -> typing.Tuple[typing.List[str], typing.Dict[str, typing.Any]]:
+    arguments: typing.List[str] = []
+    opts: typing.Dict[str, typing.Any] = {}
+    remaining = list(reversed(args))
+    while remaining:
+        token = remaining.pop()
+        if token == "--":
+            arguments.extend(reversed(remaining))
+            break
+        if not token.startswith("-") or token == "-":
+            arguments.append(token)
+            continue
+
+        if token.startswith("--"):
+            flag, equals, value = token.partition("=")
+            _store_option(ctx, opts, flag, [value] if equals else [], remaining)
+            continue
+
+        # Short options may be bundled together, such as "-vm GET",
+        # and may have their value attached, such as "-mPOST".
+        for index, char in enumerate(token[1:], start=2):
+            flag = f"-{char}"
+            option = _OPTIONS.get(flag)
+            if option is not None and option.is_flag:
+                _store_option(ctx, opts, flag, [], remaining)
+                continue
+            attached = token[index:]
+            _store_option(ctx, opts, flag, [attached] if attached else [], remaining)
+            break
+    return arguments, opts
+
+
+def _store_option(
+    ctx: click.Context,
+    opts: typing.Dict[str, typing.Any],
+    flag: str,
+    values: typing.List[str],
+    remaining: typing.List[str],
+) -> None:
+    option = _OPTIONS.get(flag)
+    if option is None:
+        raise click.NoSuchOption(flag, ctx=ctx)
+
+    if option.is_flag:
+        if values:
+            message = f"Option '{flag}' does not take a value."
+            raise click.BadOptionUsage(flag, message, ctx=ctx)
+        opts[option.name] = getattr(option, "flag_activation_value", option.flag_value)
+        return
+
+    while len(values) < option.nargs and remaining:
+        values.append(remaining.pop())
+    if len(values) < option.nargs:
+        if option.nargs == 1:
+            message = f"Option '{flag}' requires an argument."
+        else:
+            message = f"Option '{flag}' requires {option.nargs} arguments."
+        raise click.BadOptionUsage(flag, message, ctx=ctx)
+
+    value = values[0] if option.nargs == 1 else tuple(values)
+    if option.multiple:
+        opts.setdefault(option.name, []).append(value)
+    else:
+        opts[option.name] = value
+
+
+def _fast_main(args: typing.Optional[typing.Sequence[str]] = None) -> None:
+    """
+    An alternative entry point to `main`, that parses the command line in a
+    single pass over the arguments rather than going through click's parser.
+    """
+    ctx = click.Context(main, info_name="httpx")
+    try:
+        try:
+            with ctx:
+                arguments, opts = _parse_args(
+                    sys.argv[1:] if args is None else args, ctx
+                )
+                if arguments:
+                    opts["url"] = arguments[0]
+                params = sorted(main.params, key=lambda param: not param.is_eager)
+                for param in params:
+                    param.handle_parse_result(ctx, opts, [])
+                # Newer versions of click mark parameters that have no value
+                # with a sentinel, which `Command.parse_args` replaces with `None`.
+                unset = getattr(click.core, "UNSET", None)
+                for name, value in ctx.params.items():
+                    if value is unset:
+                        ctx.params[name] = None
+                if len(arguments) > 1:
+                    message = f"Got unexpected extra argument ({arguments[1]})"
+                    raise click.UsageError(message, ctx=ctx)
+                main.invoke(ctx)
+        except (EOFError, KeyboardInterrupt) as exc:
+            click.echo(file=sys.stderr)
+            raise click.Abort() from exc
+    except click.ClickException as exc:
+        exc.show()
+        sys.exit(exc.exit_code)
+    except OSError as exc:
+        if exc.errno != errno.EPIPE:
+            raise
+        # The reader went away, such as when piping into `head`. Don't let the
+        # interpreter raise again when it flushes the streams on exit.
+        sys.stdout = typing.cast(typing.TextIO, _PacifyFlushWrapper(sys.stdout))
+        sys.stderr = typing.cast(typing.TextIO, _PacifyFlushWrapper(sys.stderr))
+        sys.exit(1)
+    except click.exceptions.Exit as exc:
+        sys.exit(exc.exit_code)
+    except click.Abort:
+        click.echo("Aborted!", err=True)
         sys.exit(1)
 
-    sys.exit(0 if response.is_success else 1)
+
+class _PacifyFlushWrapper:
+    """
+    Wraps a stream, ignoring broken pipe errors when it is flushed.
+    """
+
+    def __init__(self, wrapped: typing.IO[typing.Any]) -> None:
+        self.wrapped = wrapped
+
+    def flush(self) -> None:
+        try:
+            self.wrapped.flush()
+        except OSError as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self.wrapped, name)
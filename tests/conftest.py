@@ -70,6 +70,8 @@ async def app(scope: Scope, receive: Receive, send: Send) -> None:
         await echo_headers(scope, receive, send)
     elif scope["path"].startswith("/redirect_301"):
         await redirect_301(scope, receive, send)
+    elif scope["path"].startswith("/json_formatted"):
+        await hello_world_json_formatted(scope, receive, send)
     elif scope["path"].startswith("/json"):
         await hello_world_json(scope, receive, send)
     else:
@@ -98,6 +100,20 @@ async def hello_world_json(scope: Scope, receive: Receive, send: Send) -> None:
     await send({"type": "http.response.body", "body": b'{"Hello": "world!"}'})
 
 
+async def hello_world_json_formatted(
+    scope: Scope, receive: Receive, send: Send
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [[b"content-type", b"application/json; charset=utf-8"]],
+        }
+    )
+    body = '{\n  "Hello": "wörld!"\n}'.encode("utf-8")
+    await send({"type": "http.response.body", "body": body})
+
+
 async def slow_response(scope: Scope, receive: Receive, send: Send) -> None:
     await send(
         {
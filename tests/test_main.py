@@ -1,16 +1,27 @@
+import contextlib
+import errno
+import importlib
+import io
 import os
+import subprocess
+import sys
 import typing
 
+import click
+import pytest
+import rich.console
+import rich.progress
 from click.testing import CliRunner
 
 import httpx
+from httpx._main import _fast_main, _PacifyFlushWrapper, download_response
 
 
-def splitlines(output: str) -> typing.Iterable[str]:
+def splitlines(output: str) -> typing.List[str]:
     return [line.strip() for line in output.splitlines()]
 
 
-def remove_date_header(lines: typing.Iterable[str]) -> typing.Iterable[str]:
+def remove_date_header(lines: typing.Iterable[str]) -> typing.List[str]:
     return [line for line in lines if not line.startswith("date:")]
 
 
@@ -53,6 +64,40 @@ def test_json(server):
     ]
 
 
+def test_raw_output_is_unmodified(server):
+    url = str(server.url)
+    runner = CliRunner()
+    result = runner.invoke(httpx.main, [url])
+    assert result.exit_code == 0
+    assert result.stdout_bytes.endswith(b"\n\nHello, world!")
+
+
+def test_output_without_binary_buffer(server):
+    url = str(server.url)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with pytest.raises(SystemExit) as exc_info:
+            httpx.main.main([url], standalone_mode=False)
+    assert exc_info.value.code == 0
+    assert output.getvalue().endswith("\n\nHello, world!")
+
+
+def test_json_is_reformatted(server):
+    url = str(server.url.copy_with(path="/json"))
+    runner = CliRunner()
+    result = runner.invoke(httpx.main, [url])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[-3:] == ["{", '    "Hello": "world!"', "}"]
+
+
+def test_formatted_json_is_printed_as_is(server):
+    url = str(server.url.copy_with(path="/json_formatted"))
+    runner = CliRunner()
+    result = runner.invoke(httpx.main, [url])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[-3:] == ["{", '  "Hello": "wörld!"', "}"]
+
+
 def test_binary(server):
     url = str(server.url.copy_with(path="/echo_binary"))
     runner = CliRunner()
@@ -168,6 +213,33 @@ def test_auth(server):
     ]
 
 
+def test_terminal_output(server, monkeypatch):
+    console = rich.console.Console(force_terminal=True)
+    monkeypatch.setattr("httpx._main._CONSOLE", console)
+    url = str(server.url.copy_with(path="/json"))
+    runner = CliRunner()
+    result = runner.invoke(httpx.main, [url, "-v"])
+    assert result.exit_code == 0
+    assert "\x1b[" in result.output
+    assert remove_date_header(splitlines(click.unstyle(result.output)))[2:] == [
+        "GET /json HTTP/1.1",
+        f"Host: {server.url.netloc.decode('ascii')}",
+        "Accept: */*",
+        "Accept-Encoding: gzip, deflate, br",
+        "Connection: keep-alive",
+        f"User-Agent: python-httpx/{httpx.__version__}",
+        "",
+        "HTTP/1.1 200 OK",
+        "server: uvicorn",
+        "content-type: application/json",
+        "Transfer-Encoding: chunked",
+        "",
+        "{",
+        '"Hello": "world!"',
+        "}",
+    ]
+
+
 def test_download(server):
     url = str(server.url)
     runner = CliRunner()
@@ -178,6 +250,31 @@ def test_download(server):
             assert input_file.read() == "Hello, world!"
 
 
+def test_download_progress_is_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr("httpx._main._PROGRESS_UPDATE_INTERVAL", float("inf"))
+    updates = []
+    original_update = rich.progress.Progress.update
+
+    def update(self, task_id, **kwargs):
+        updates.append(kwargs["completed"])
+        original_update(self, task_id, **kwargs)
+
+    monkeypatch.setattr(rich.progress.Progress, "update", update)
+    response = httpx.Response(200, content=iter([b"x" * 64 * 1024] * 40))
+    with open(tmp_path / "download.bin", "wb") as download:
+        download_response(response, download)
+    # 40 chunks of 64 KiB, with the bar redrawn every 1 MiB, and once at the end.
+    assert updates == [1048576, 2097152, 2621440]
+
+
+def test_download_with_invalid_content_length(tmp_path):
+    headers = {"Content-Length": "abc"}
+    response = httpx.Response(200, headers=headers, content=iter([b"Hello"]))
+    with open(tmp_path / "download.bin", "wb") as download:
+        download_response(response, download)
+    assert (tmp_path / "download.bin").read_bytes() == b"Hello"
+
+
 def test_errors():
     runner = CliRunner()
     result = runner.invoke(httpx.main, ["invalid://example.org"])
@@ -185,3 +282,185 @@ def test_errors():
     assert splitlines(result.output) == [
         "UnsupportedProtocol: Request URL has an unsupported protocol 'invalid://'.",
     ]
+
+
+def test_fast_main_get(server, capsys):
+    url = str(server.url)
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main([url])
+    assert exc_info.value.code == 0
+    assert remove_date_header(splitlines(capsys.readouterr().out)) == [
+        "HTTP/1.1 200 OK",
+        "server: uvicorn",
+        "content-type: text/plain",
+        "Transfer-Encoding: chunked",
+        "",
+        "Hello, world!",
+    ]
+
+
+def test_fast_main_help(capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(["--help"])
+    assert exc_info.value.code == 0
+    assert "A next generation HTTP client." in capsys.readouterr().out
+
+
+def test_fast_main_options(server, capsys):
+    url = str(server.url.copy_with(path="/echo_headers"))
+    args = ["-h", "X-Test", "1", "--cookies", "a", "b", "--auth", "user", "pass"]
+    args += ["--timeout=10", "--follow-redirects", "--no-verify", "--", url]
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(args)
+    assert exc_info.value.code == 0
+    output = capsys.readouterr().out
+    assert '"X-test": "1"' in output
+    assert '"Cookie": "a=b"' in output
+    assert '"Authorization": "Basic dXNlcjpwYXNz"' in output
+
+
+def test_fast_main_post(server, tmp_path, capsys):
+    upload = tmp_path / "upload.txt"
+    upload.write_bytes(b"Hello, world!")
+    url = str(server.url.copy_with(path="/echo_body"))
+    args = [url, "-m", "PUT", "-p", "a", "1", "-d", "b", "2", "-f", "c", str(upload)]
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(args)
+    assert exc_info.value.code == 0
+    assert "Hello, world!" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main([url, "-j", '{"hello": "world"}'])
+    assert exc_info.value.code == 0
+    assert '{"hello": "world"}' in splitlines(capsys.readouterr().out)
+
+
+def test_fast_main_download(server, tmp_path):
+    path = tmp_path / "index.txt"
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main([str(server.url), "--download", str(path)])
+    assert exc_info.value.code == 0
+    assert path.read_text() == "Hello, world!"
+
+
+def test_fast_main_short_options(server, capsys):
+    url = str(server.url.copy_with(path="/echo_body"))
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main([url, "-vmPUT", "-cHello"])
+    assert exc_info.value.code == 0
+    lines = splitlines(capsys.readouterr().out)
+    assert "PUT /echo_body HTTP/1.1" in lines
+    assert lines[-1] == "Hello"
+
+
+@pytest.mark.parametrize(
+    "args,message",
+    [
+        ([], "Missing argument 'URL'."),
+        (["http://a", "http://b"], "Got unexpected extra argument (http://b)"),
+        (["http://a", "--unknown"], "--unknown"),
+        (["http://a", "-vx"], "-x"),
+        (["http://a", "--method"], "Option '--method' requires an argument."),
+        (["http://a", "-p", "a"], "Option '-p' requires 2 arguments."),
+        (["http://a", "--verbose=1"], "Option '--verbose' does not take a value."),
+        (["http://a", "--timeout", "abc"], "'abc' is not a valid float."),
+        (["http://a", "-j", "{"], "Not valid JSON"),
+    ],
+)
+def test_fast_main_usage_errors(args, message, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(args)
+    assert exc_info.value.code == 2
+    err = capsys.readouterr().err
+    assert err.startswith("Usage: httpx [OPTIONS] URL")
+    assert message in err
+
+
+def test_fast_main_download_error(server, tmp_path, capsys):
+    path = tmp_path / "missing" / "index.txt"
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main([str(server.url), "--download", str(path)])
+    assert exc_info.value.code == 1
+    assert "Could not open file" in capsys.readouterr().err
+
+
+def test_fast_main_aborted_prompt(monkeypatch, capsys):
+    def prompt(*args, **kwargs):
+        raise click.Abort()
+
+    monkeypatch.setattr(click, "prompt", prompt)
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(["http://example.org", "--auth", "user", "-"])
+    assert exc_info.value.code == 1
+    assert "Aborted!" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("exc", [KeyboardInterrupt, EOFError])
+def test_fast_main_interrupted(exc, monkeypatch, capsys):
+    def callback(**kwargs):
+        raise exc()
+
+    monkeypatch.setattr(httpx._main.main, "callback", callback)
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(["http://example.org"])
+    assert exc_info.value.code == 1
+    assert capsys.readouterr().err == "\nAborted!\n"
+
+
+def test_fast_main_broken_pipe(monkeypatch, capsys):
+    def callback(**kwargs):
+        raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+
+    # `_fast_main` replaces the standard streams, so make sure they're restored.
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    monkeypatch.setattr(sys, "stderr", sys.stderr)
+    monkeypatch.setattr(httpx._main.main, "callback", callback)
+    with pytest.raises(SystemExit) as exc_info:
+        _fast_main(["http://example.org"])
+    assert exc_info.value.code == 1
+    assert capsys.readouterr().err == ""
+    assert isinstance(sys.stdout, _PacifyFlushWrapper)
+
+
+def test_pacify_flush_wrapper():
+    class ClosedStream(io.StringIO):
+        def __init__(self, errno: int) -> None:
+            super().__init__()
+            self.errno = errno
+
+        def flush(self) -> None:
+            raise OSError(self.errno, "Error")
+
+    stream = _PacifyFlushWrapper(ClosedStream(errno.EPIPE))
+    stream.flush()
+    assert stream.getvalue() == ""
+
+    stream = _PacifyFlushWrapper(ClosedStream(errno.EIO))
+    with pytest.raises(OSError):
+        stream.flush()
+
+
+def test_fast_main_os_error(monkeypatch):
+    def callback(**kwargs):
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    monkeypatch.setattr(httpx._main.main, "callback", callback)
+    with pytest.raises(PermissionError):
+        _fast_main(["http://example.org"])
+
+
+@pytest.mark.parametrize("package", ["rich", "pygments"])
+def test_missing_cli_dependency(package, monkeypatch):
+    monkeypatch.setitem(sys.modules, package, None)
+    monkeypatch.delitem(sys.modules, "httpx._main")
+    with pytest.raises(ImportError):
+        importlib.import_module("httpx._main")
+
+
+def test_missing_cli_dependency_prompts_install():
+    code = "import sys; sys.modules['rich'] = None; import httpx; httpx.main()"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert result.returncode == 1
+    assert "pip install 'httpx[cli]'" in result.stdout